@@ -1,16 +1,44 @@
 #!/usr/bin/env python3
 """
-Master script that runs all conversion steps in order:
+Master script that runs all conversion steps:
 1. Convert .mov files to .mp4
 2. Update _chat.txt to replace .mov with .mp4 references
 3. Generate HTML from the chat
+
+Step 1 runs concurrently with steps 2 and 3, since the HTML only needs the
+updated _chat.txt, not the converted video files themselves. If ffmpeg is not
+installed, step 2 waits for step 1 instead, so a failed conversion leaves
+_chat.txt untouched. When given a parent folder of several chat exports, the
+pipelines for all chats run in parallel.
 """
 
+import os
+import shlex
+import shutil
 import sys
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 
-def run_command(script_name, args, description):
+# Steps may run concurrently. Everything printed while they run (banners, messages and
+# each step's captured output) is written under this lock, one whole block at a time
+_print_lock = threading.Lock()
+
+# libx264 already spreads a single encode over all cores, so only a few conversions
+# run at once (one per four CPUs) to avoid oversubscribing the machine
+_conversion_slots = threading.BoundedSemaphore(max(1, (os.cpu_count() or 1) // 4))
+
+# Every step passes through this gate, so a large batch never has more child scripts
+# (and capture pipes) alive than there are CPUs. At least two, so a conversion can
+# still overlap with the other steps on a single-CPU machine
+_step_slots = threading.BoundedSemaphore(max(2, os.cpu_count() or 1))
+
+# Set on Ctrl+C so that steps still waiting for a slot don't start and finished
+# steps don't print anything after the interrupt message
+_interrupted = threading.Event()
+
+def run_command(script_name, args, description, capture_output=False):
     """
     Run a Python script and return success status
     
@@ -18,6 +46,8 @@ def run_command(script_name, args, description):
         script_name: Name of the script to run
         args: List of arguments to pass to the script
         description: Description of what the script does
+        capture_output: If True, collect the script's output and print it as one
+                        block once the script has finished
     
     Returns:
         True if successful, False otherwise
@@ -25,33 +55,225 @@ def run_command(script_name, args, description):
     script_path = Path(__file__).parent / 'scripts' / script_name
     
     if not script_path.exists():
-        print(f"❌ Script not found: {script_name}")
+        with _print_lock:
+            print(f"❌ Script not found: {script_name}")
         return False
     
-    print()
-    print("=" * 60)
-    print(f"   {description}")
-    print("=" * 60)
-    print()
-    
     cmd = [sys.executable, str(script_path)] + args
     
+    # Wait for a conversion slot before taking a general one, so queued conversions
+    # don't hold up the other steps
+    if script_name == 'convert_mov_to_mp4.py':
+        with _conversion_slots, _step_slots:
+            return _run_script(cmd, script_name, description, capture_output)
+    with _step_slots:
+        return _run_script(cmd, script_name, description, capture_output)
+
+def _run_script(cmd, script_name, description, capture_output):
+    """Run the command built by run_command and return success status"""
+    if _interrupted.is_set():
+        return False
+    
+    banner = "=" * 60
+    header = f"\n{banner}\n   {description}\n{banner}\n"
+    
     try:
-        result = subprocess.run(cmd, check=True)
-        return result.returncode == 0
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error running {script_name}: {e}")
+        if capture_output:
+            with _print_lock:
+                print(f"▶️  Started: {description}", flush=True)
+            # The scripts print emojis, so don't let a pipe fall back to the locale encoding
+            env = dict(os.environ, PYTHONIOENCODING='utf-8')
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    encoding='utf-8', errors='replace', env=env)
+        else:
+            with _print_lock:
+                print(header, flush=True)
+            result = subprocess.run(cmd)
+    except OSError as e:
+        # E.g. running out of processes or file descriptors
+        with _print_lock:
+            print(f"❌ Error running {script_name}: {e}")
         return False
     except KeyboardInterrupt:
-        print(f"\n⚠️  Interrupted by user")
+        with _print_lock:
+            _interrupted.set()
+            print(f"\n⚠️  Interrupted by user")
         return False
+    
+    with _print_lock:
+        if _interrupted.is_set():
+            return False
+        if capture_output:
+            print(header)
+            print(result.stdout, end='')
+        if result.returncode != 0:
+            error = subprocess.CalledProcessError(result.returncode, cmd)
+            print(f"❌ Error running {script_name}: {error}")
+        sys.stdout.flush()
+    return result.returncode == 0
+
+def has_pending_mov_files(folder_path, overwrite=False, recursive=False):
+    """
+    Check whether any .mov file in the folder still needs converting to .mp4
+    
+    Args:
+        folder_path: Path to the WhatsApp folder
+        overwrite: If True, .mov files with an existing .mp4 also count as pending
+        recursive: If True, also look in subdirectories
+    
+    Returns:
+        True if at least one .mov file needs converting, False otherwise
+    """
+    # A single walk with a case-insensitive suffix check covers both .mov and .MOV,
+    # and needs one directory read per folder instead of a stat() per file
+    if recursive:
+        walker = os.walk(folder_path)
+    else:
+        with os.scandir(folder_path) as entries:
+            walker = [(folder_path, [], [entry.name for entry in entries if entry.is_file()])]
+    
+    for _, _, names in walker:
+        mp4_stems = {name[:-4] for name in names if name.lower().endswith('.mp4')}
+        if any(name.lower().endswith('.mov') and (overwrite or name[:-4] not in mp4_stems)
+               for name in names):
+            return True
+    return False
+
+def run_pipeline(steps, executor, sequential=False):
+    """
+    Run pipeline steps, starting each step as soon as its dependencies have succeeded
+    
+    Args:
+        steps: List of (step_id, script_name, args, description, depends_on,
+               capture_output) tuples, listed in dependency order
+        executor: Shared executor the steps are submitted to
+        sequential: If True, run the steps one at a time; a failed step skips the rest
+                    of its own chat, and Ctrl+C stops the whole run
+    
+    Returns:
+        Dict mapping step_id to True (succeeded), False (failed) or None (not run),
+        or None if the run was interrupted by the user
+    """
+    results = {step[0]: None for step in steps}
+    
+    if sequential:
+        failed_folders = set()
+        for step_id, script_name, args, description, _, _ in steps:
+            if step_id[0] in failed_folders:
+                continue
+            results[step_id] = run_command(script_name, args, description)
+            if _interrupted.is_set():
+                break
+            if not results[step_id]:
+                failed_folders.add(step_id[0])
+        return results
+    
+    pending = list(steps)
+    running = {}
+    try:
+        while pending or running:
+            for step in list(pending):
+                step_id, script_name, args, description, depends_on, capture_output = step
+                # Dependencies on steps that are not part of this run count as satisfied
+                dep_results = [results[dep] for dep in depends_on if dep in results]
+                if any(result is False for result in dep_results):
+                    pending.remove(step)
+                elif all(dep_results):
+                    pending.remove(step)
+                    future = executor.submit(run_command, script_name, args, description,
+                                             capture_output)
+                    running[future] = step_id
+            
+            if not running:
+                break
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    except KeyboardInterrupt:
+        # Only the main thread sees Ctrl+C. The running scripts get it through the
+        # process group; steps still waiting for a slot check the flag and give up
+        with _print_lock:
+            _interrupted.set()
+            print(f"\n⚠️  Interrupted by user")
+        return None
+    
+    return results
+
+def build_steps(folder_path, all_args, batch=False):
+    """
+    Build the pipeline steps for one WhatsApp folder
+    
+    Args:
+        folder_path: Path to the WhatsApp folder containing _chat.txt
+        all_args: Command line options given after the folder
+        batch: If True, the folder is one of several chats processed together
+    
+    Returns:
+        List of (step_id, script_name, args, description, depends_on, capture_output)
+        tuples, where each step_id is a (folder_path, step_number) tuple
+    """
+    skip_mov_convert = '--skip-mov-convert' in all_args
+    skip_update_chat = '--skip-update-chat' in all_args
+    no_backup = '--no-backup' in all_args
+    recursive = '--recursive' in all_args or '-r' in all_args
+    overwrite = '--overwrite' in all_args or '-f' in all_args
+    suffix = f" ({folder_path.name})" if batch else ""
+    
+    # Filter out our special options
+    conversion_args = [arg for arg in all_args 
+                     if arg not in ['--skip-mov-convert', '--skip-update-chat', '--no-backup',
+                                    '--sequential']]
+    
+    # Add folder path to conversion args
+    conversion_args = [str(folder_path)] + conversion_args
+    
+    print(f"📁 Processing folder: {folder_path.name}")
+    steps = []
+    update_depends_on = []
+    
+    # Step 1: Convert .mov to .mp4
+    if skip_mov_convert:
+        print()
+        print("⏭️  Skipping .mov to .mp4 conversion (--skip-mov-convert)")
+    elif not has_pending_mov_files(folder_path, overwrite, recursive):
+        # Nothing to convert, so don't spawn the conversion script (and its ffmpeg check)
+        print()
+        print("⏭️  No .mov files to convert, skipping .mov to .mp4 conversion")
+    else:
+        # The conversion can take minutes, so its output is only collected into one
+        # block when several chats share the terminal; on its own it streams live
+        steps.append(((folder_path, 1), 'convert_mov_to_mp4.py', conversion_args,
+                      'Step 1: Convert .mov Files to .mp4' + suffix, [], batch))
+        # Without ffmpeg the conversion is bound to fail, so don't let _chat.txt be
+        # rewritten to point at .mp4 files that will never exist
+        if shutil.which('ffmpeg') is None:
+            update_depends_on = [(folder_path, 1)]
+    
+    # Step 2: Update _chat.txt
+    if not skip_update_chat:
+        update_args = [str(folder_path)]
+        if no_backup:
+            update_args.append('--no-backup')
+        steps.append(((folder_path, 2), 'update_chat_txt.py', update_args,
+                      'Step 2: Update _chat.txt' + suffix, update_depends_on, True))
+    else:
+        print()
+        print("⏭️  Skipping _chat.txt update (--skip-update-chat)")
+    
+    # Step 3: Generate HTML (only needs the updated _chat.txt, not the .mp4 files)
+    html_args = [str(folder_path)]
+    steps.append(((folder_path, 3), 'convert_whatsapp_to_html.py', html_args,
+                  'Step 3: Generate HTML' + suffix, [(folder_path, 2)], True))
+    
+    return steps
 
 def main():
     print("=" * 60)
     print("   WhatsApp Chat - Complete Conversion Pipeline")
     print("=" * 60)
     print()
-    print("This script will run all conversion steps in order:")
+    print("This script will run all conversion steps:")
     print("  1. Convert .mov files to .mp4")
     print("  2. Update _chat.txt to replace .mov with .mp4 references")
     print("  3. Generate HTML from the chat")
@@ -61,6 +283,7 @@ def main():
     if len(sys.argv) < 2:
         print("Usage:")
         print("  python3 generate_html.py <whatsapp_folder> [options]")
+        print("  python3 generate_html.py <folder_with_several_whatsapp_folders> [options]")
         print()
         print("Options (passed to conversion script):")
         print("  --recursive, -r       Search subdirectories recursively for .mov files")
@@ -69,11 +292,13 @@ def main():
         print("  --no-backup           Don't create backup of _chat.txt")
         print("  --skip-mov-convert    Skip .mov to .mp4 conversion step")
         print("  --skip-update-chat    Skip _chat.txt update step")
+        print("  --sequential          Run the steps one after another, with all output live")
         print()
         print("Examples:")
         print("  python3 generate_html.py my_whatsapp_data")
         print("  python3 generate_html.py my_whatsapp_data --delete-original")
         print("  python3 generate_html.py my_whatsapp_data --recursive --delete-original")
+        print("  python3 generate_html.py my_whatsapp_exports --delete-original")
         return
     
     folder_path = Path(sys.argv[1])
@@ -86,80 +311,73 @@ def main():
         print(f"❌ Not a directory: {folder_path}")
         return
     
-    # Check for _chat.txt
-    chat_file = folder_path / '_chat.txt'
-    if not chat_file.exists():
-        print(f"❌ _chat.txt not found in: {folder_path}")
-        return
+    # Check for _chat.txt, falling back to a batch of chat folders one level down
+    if (folder_path / '_chat.txt').exists():
+        chat_folders = [folder_path]
+    else:
+        chat_folders = sorted(sub for sub in folder_path.iterdir()
+                              if sub.is_dir() and (sub / '_chat.txt').exists())
+        if not chat_folders:
+            print(f"❌ _chat.txt not found in: {folder_path}")
+            return
+        print(f"📚 Found {len(chat_folders)} chat folders in: {folder_path}")
+        print()
     
     # Extract options
     all_args = sys.argv[2:]
-    skip_mov_convert = '--skip-mov-convert' in all_args
-    skip_update_chat = '--skip-update-chat' in all_args
-    no_backup = '--no-backup' in all_args
+    sequential = '--sequential' in all_args
+    batch = chat_folders != [folder_path]
     
-    # Filter out our special options
-    conversion_args = [arg for arg in all_args 
-                     if arg not in ['--skip-mov-convert', '--skip-update-chat', '--no-backup']]
+    steps = []
+    for chat_folder in chat_folders:
+        steps.extend(build_steps(chat_folder, all_args, batch=batch))
     
-    # Add folder path to conversion args
-    conversion_args = [str(folder_path)] + conversion_args
+    # One worker pool for the whole run, shared by all steps of all folders. The threads
+    # only wait on child processes, so every step gets one and nothing queues behind
+    # a long conversion; how many scripts actually run at once is capped in run_command
+    with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+        results = run_pipeline(steps, executor, sequential=sequential)
     
-    # Step 1: Convert .mov to .mp4
-    if not skip_mov_convert:
-        print(f"📁 Processing folder: {folder_path.name}")
-        success = run_command(
-            'convert_mov_to_mp4.py',
-            conversion_args,
-            'Step 1: Convert .mov Files to .mp4'
-        )
-        if not success:
-            print()
-            print("❌ Step 1 failed. Aborting.")
-            return
-    else:
-        print()
-        print("⏭️  Skipping .mov to .mp4 conversion (--skip-mov-convert)")
-    
-    # Step 2: Update _chat.txt
-    if not skip_update_chat:
-        update_args = [str(folder_path)]
-        if no_backup:
-            update_args.append('--no-backup')
-        
-        success = run_command(
-            'update_chat_txt.py',
-            update_args,
-            'Step 2: Update _chat.txt'
-        )
-        if not success:
-            print()
-            print("❌ Step 2 failed. Aborting.")
-            return
-    else:
-        print()
-        print("⏭️  Skipping _chat.txt update (--skip-update-chat)")
-    
-    # Step 3: Generate HTML
-    html_args = [str(folder_path)]
-    success = run_command(
-        'convert_whatsapp_to_html.py',
-        html_args,
-        'Step 3: Generate HTML'
-    )
+    if results is None:
+        return
     
-    if success:
+    if all(results.values()):
         print()
         print("=" * 60)
         print("✅ ALL STEPS COMPLETED SUCCESSFULLY!")
         print("=" * 60)
-        print()
-        print(f"📄 HTML file generated: {folder_path.name}_chat.html")
-        print(f"📁 Location: {folder_path.parent}")
-    else:
-        print()
-        print("❌ Step 3 failed.")
-        return
+    
+    step_args = {step_id: args for step_id, _, args, _, _, _ in steps}
+    print()
+    for chat_folder in chat_folders:
+        folder_results = {step_number: success for (folder, step_number), success
+                          in results.items() if folder == chat_folder}
+        prefix = f"{chat_folder.name}: " if batch else ""
+        
+        for step_number, success in folder_results.items():
+            if success is False:
+                print(f"❌ {prefix}Step {step_number} failed.")
+            elif success is None and (batch or not sequential):
+                print(f"⏭️  {prefix}Step {step_number} was not run.")
+        
+        if not folder_results[3]:
+            continue
+        
+        # Steps 2 and 3 don't wait for the conversion, so they may have succeeded without it
+        if folder_results.get(1) is False and folder_results.get(2):
+            # Quote each argument since export folder names usually contain spaces
+            # (shlex.join needs Python 3.8)
+            script_path = Path(__file__).parent / 'scripts' / 'convert_mov_to_mp4.py'
+            retry_cmd = ' '.join(shlex.quote(arg) for arg in
+                                 [sys.executable, str(script_path)] + step_args[(chat_folder, 1)])
+            print(f"⚠️  {prefix}_chat.txt was updated and the HTML was generated, "
+                  f"but the .mp4 files are missing.")
+            print(f"   Re-run the conversion with: {retry_cmd}")
+        print(f"📄 HTML file generated: {chat_folder.name}_chat.html")
+        print(f"📁 Location: {chat_folder.parent}")
+    
+    if sequential and not batch and None in results.values():
+        print("❌ Aborting.")
 
 if __name__ == '__main__':
     main()